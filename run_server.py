@@ -0,0 +1,23 @@
+import asyncio
+import sys
+
+sys.path.insert(0, "src")
+
+from mcp_filesystem.server import FilesystemServer
+
+
+async def main():
+    root_dir = sys.argv[1] if len(sys.argv) > 1 else "."
+    # セットアップと後始末をコンテキストマネージャに任せる
+    async with FilesystemServer(root_dir) as server:
+        await server.serve()
+
+
+if __name__ == "__main__":
+    # 利用可能ならlibuvベースのイベントループに差し替える
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(main())
@@ -0,0 +1,398 @@
+import asyncio
+import base64
+import concurrent.futures
+import json
+import os
+import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Literal, Optional
+
+from watchfiles import awatch
+
+
+# 1チャンクあたりの読み出しサイズ（4 MiB）
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 1行（JSON-RPCメッセージ）の最大長。writeのcontentがそのまま載るため、
+# StreamReaderデフォルトの64 KiBでは普通のwriteですぐ溢れる
+MAX_LINE_SIZE = 64 * 1024 * 1024
+
+
+def _read_sync(path, offset: int, length: int) -> bytes:
+    with open(path, 'rb') as f:
+        if offset:
+            f.seek(offset)
+        return f.read(length)
+
+
+def _write_sync(path, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@lru_cache(maxsize=1024)
+def _resolve_cached(root_str: str, rel: str) -> Path:
+    # resolve()はパス要素ごとにstatを辿るため、頻繁にアクセスされる
+    # パスの解決結果をキャッシュする（変更検知時にクリアされる）
+    return (Path(root_str) / rel).resolve(strict=False)
+
+
+class InvalidPathError(Exception):
+    """root_dir外のパスが要求された場合に送出される"""
+
+
+class FilesystemServer:
+    __slots__ = (
+        "root_dir",
+        "_root_str",
+        "_root_str_sep",
+        "io_backend",
+        "batch_change_notifications",
+        "_aio_ctx",
+        "_io_sem",
+        "_send_lock",
+        "_reader",
+        "_writer",
+        "_watch_task",
+        "_request_tasks",
+    )
+
+    # メソッド名→ハンドラのディスパッチテーブル（リクエストごとに
+    # dictやbound methodを作らないようクラス属性にしておく）
+    _DISPATCH = {
+        "filesystem/list": "_handle_list",
+        "filesystem/read": "_handle_read",
+        "filesystem/write": "_handle_write",
+    }
+
+    def __init__(
+        self,
+        root_dir: str,
+        io_backend: Literal["thread", "aio"] = "thread",
+        batch_change_notifications: bool = True,
+    ):
+        self.root_dir = Path(root_dir).resolve()
+        # ホットパスで毎回str(self.root_dir)し直さないための不変値
+        self._root_str = str(self.root_dir)
+        self._root_str_sep = self._root_str + os.sep
+        self.io_backend = io_backend
+        # Falseにするとイベント1件ごとに従来のfilesystem/changedを送る
+        self.batch_change_notifications = batch_change_notifications
+        self._aio_ctx = None
+        # 同時に走るファイルRPC数の上限（executorのキューではなく
+        # セマフォ側で並行度を制御する）
+        self._io_sem = asyncio.Semaphore(int(os.getenv("MCP_FS_MAX_IO", "64")))
+        # rawボディ送出中にほかのメッセージが割り込まないようにする
+        self._send_lock = asyncio.Lock()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        # 実行中のリクエストタスクへの参照（GC防止と終了時のドレイン用）
+        self._request_tasks = set()
+
+    async def __aenter__(self) -> 'FilesystemServer':
+        """stdin/stdoutをasyncioストリームに接続し、監視タスクを開始する"""
+        loop = asyncio.get_running_loop()
+
+        # セマフォが並行度を決めるよう、デフォルトのスレッドプールは
+        # 詰まらない程度に広げておく
+        loop.set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=128)
+        )
+
+        if self.io_backend == "aio":
+            # Linux libaio経由でカーネルのI/Oキューに直接submitする
+            try:
+                from caio import AsyncioContext
+                self._aio_ctx = AsyncioContext(max_requests=128)
+            except ImportError:
+                # caio未導入の環境ではスレッドプールにフォールバック
+                self._aio_ctx = None
+
+        reader = asyncio.StreamReader(limit=MAX_LINE_SIZE)
+        protocol = asyncio.StreamReaderProtocol(reader)
+        await loop.connect_read_pipe(lambda: protocol, sys.stdin)
+        self._reader = reader
+
+        w_transport, w_protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, sys.stdout
+        )
+        self._writer = asyncio.StreamWriter(w_transport, w_protocol, None, loop)
+
+        # root_dir以下の変更を監視して通知を送る
+        self._watch_task = asyncio.create_task(self._watch_filesystem())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+        # 実行中のリクエストを処理し切ってから片付ける
+        if self._request_tasks:
+            await asyncio.gather(*self._request_tasks, return_exceptions=True)
+        if self._aio_ctx is not None:
+            self._aio_ctx.close()
+
+    async def serve(self):
+        """リクエストループを回す（各リクエストは並行処理される）"""
+        while True:
+            try:
+                line = await self._reader.readline()
+            except ValueError:
+                # limit超過。サーバごと落とさず、パースエラーとして返す
+                await self._send({
+                    "jsonrpc": "2.0",
+                    "id": None,
+                    "error": {"code": -32700, "message": "Parse error: request line too long"}
+                })
+                continue
+            if not line:
+                break
+            # 参照を保持しないとタスクが実行途中でGCされうる
+            task = asyncio.create_task(self._process_line(line))
+            self._request_tasks.add(task)
+            task.add_done_callback(self._request_tasks.discard)
+
+    async def start(self):
+        """セットアップとリクエストループを一括で行う従来のAPI"""
+        async with self:
+            await self.serve()
+
+    async def _process_line(self, line: bytes):
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            await self._send({
+                "jsonrpc": "2.0",
+                "id": None,
+                "error": {"code": -32700, "message": f"Parse error: {e}"}
+            })
+            return
+        response = await self.handle_request(request)
+        await self._send(response)
+
+    async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """JSON-RPCリクエストを対応するハンドラにディスパッチする"""
+        request_id = request.get("id")
+        name = self._DISPATCH.get(request.get("method"))
+        if name is None:
+            return {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": -32601, "message": f"Method not found: {request.get('method')}"}
+            }
+
+        try:
+            result = await getattr(self, name)(request.get("params") or {})
+            return {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except InvalidPathError as e:
+            return {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": -32602, "message": str(e)}
+            }
+        except Exception as e:
+            return {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": -32603, "message": f"Internal error: {e}"}
+            }
+
+    def _validate_path(self, path: str) -> Path:
+        """root_dir配下に収まっているか検証し、解決済みの絶対パスを返す"""
+        # 文字列のstartswithは /root が /rootx にもマッチしてしまう上に
+        # パス全体の文字列化が必要になるので、パス部品の比較で判定する
+        try:
+            full_path = _resolve_cached(self._root_str, path)
+            full_path.relative_to(self.root_dir)
+        except ValueError:
+            raise InvalidPathError("Path outside root directory")
+        except OSError as e:
+            raise InvalidPathError(f"Invalid path: {e}")
+        return full_path
+
+    async def _handle_list(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        full_path = self._validate_path(params.get("path", "."))
+        async with self._io_sem:
+            # ループ全体を1回のexecutorディスパッチで実行する
+            entries = await asyncio.to_thread(self._list_sync, full_path)
+        return {"entries": entries}
+
+    def _list_sync(self, full_path: Path) -> list:
+        # os.scandirのDirEntryはgetdentsの結果をキャッシュしているため、
+        # Path.iterdir + is_dir/is_file/statのようにエントリごとに
+        # syscallを重ねずに済む
+        entries = []
+        with os.scandir(full_path) as it:
+            for e in it:
+                is_file = e.is_file(follow_symlinks=False)
+                entries.append({
+                    "name": e.name,
+                    "path": e.path[len(self._root_str_sep):],
+                    "type": "directory" if e.is_dir(follow_symlinks=False) else "file",
+                    "size": e.stat(follow_symlinks=False).st_size if is_file else None,
+                })
+        return entries
+
+    async def _handle_read(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        full_path = self._validate_path(params["path"])
+        offset = params.get("offset", 0)
+        length = params.get("length")
+        if length is None:
+            length = full_path.stat().st_size - offset
+
+        async with self._io_sem:
+            # raw指定時はJSONに載せず、ヘッダ通知のあとに本文を
+            # sendfileでそのままパイプへ流す（ゼロコピー）
+            if params.get("raw"):
+                return await self._read_sendfile(
+                    full_path, params["path"], offset, length
+                )
+
+            # 小さい読み出しは従来どおり1レスポンスで返す
+            if length <= READ_CHUNK_SIZE:
+                if self._aio_ctx is not None:
+                    content = await self._read_aio(full_path, offset, length)
+                else:
+                    # open+read+closeを1回のexecutorディスパッチにまとめる
+                    content = await asyncio.to_thread(_read_sync, full_path, offset, length)
+                return {
+                    "content": base64.b64encode(content).decode(),
+                    "size": len(content),
+                }
+
+            # 大きい読み出しは4 MiBごとに通知としてストリームし、
+            # ファイル全体をメモリに載せない
+            fd = os.open(full_path, os.O_RDONLY)
+            total = 0
+            chunks = 0
+            try:
+                while total < length:
+                    chunk = await asyncio.to_thread(
+                        os.pread, fd, min(READ_CHUNK_SIZE, length - total), offset + total
+                    )
+                    if not chunk:
+                        break
+                    await self.notify("filesystem/read_chunk", {
+                        "path": params["path"],
+                        "offset": offset + total,
+                        "content": base64.b64encode(chunk).decode(),
+                    })
+                    total += len(chunk)
+                    chunks += 1
+            finally:
+                os.close(fd)
+            return {"size": total, "chunks": chunks}
+
+    async def _read_sendfile(
+        self, full_path: Path, path: str, offset: int, length: int
+    ) -> Dict[str, Any]:
+        fd = os.open(full_path, os.O_RDONLY)
+        sent = 0
+        try:
+            async with self._send_lock:
+                # transportのバッファを完全に吐き切ってから生FDへ書く。
+                # drain()はhigh-water markまでしか待たないため、バッファが
+                # 空になるのを明示的に待たないと本文がヘッダを追い越す
+                await self._writer.drain()
+                while self._writer.transport.get_write_buffer_size() > 0:
+                    await asyncio.sleep(0)
+
+                # connect_write_pipeでfd 1はノンブロッキングになっており、
+                # そのままではパイプバッファが埋まった時点でEAGAINになる。
+                # 転送の間だけブロッキングに戻す
+                out_fd = sys.stdout.fileno()
+                os.set_blocking(out_fd, True)
+                try:
+                    header = {
+                        "jsonrpc": "2.0",
+                        "method": "filesystem/raw_body",
+                        "params": {"path": path, "size": length},
+                    }
+                    await asyncio.to_thread(
+                        os.write, out_fd, (json.dumps(header) + "\n").encode()
+                    )
+                    # ヘッダに続けて、ページキャッシュから出力FDへ
+                    # ユーザー空間コピーなしで本文を送る
+                    while sent < length:
+                        want = min(READ_CHUNK_SIZE, length - sent)
+                        try:
+                            n = await asyncio.to_thread(
+                                os.sendfile, out_fd, fd, offset + sent, want
+                            )
+                        except OSError:
+                            # sendfile非対応の出力先ではユーザー空間コピーに戻す
+                            chunk = await asyncio.to_thread(
+                                os.pread, fd, want, offset + sent
+                            )
+                            if not chunk:
+                                break
+                            n = await asyncio.to_thread(os.write, out_fd, chunk)
+                        if n == 0:
+                            break
+                        sent += n
+                finally:
+                    os.set_blocking(out_fd, False)
+        finally:
+            os.close(fd)
+        return {"size": sent, "raw": True}
+
+    async def _read_aio(self, full_path: Path, offset: int, length: int) -> bytes:
+        fd = os.open(full_path, os.O_RDONLY)
+        try:
+            return await self._aio_ctx.read(length, fd, offset)
+        finally:
+            os.close(fd)
+
+    async def _handle_write(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        full_path = self._validate_path(params["path"])
+        content = params["content"]
+        async with self._io_sem:
+            await asyncio.to_thread(
+                _write_sync,
+                full_path,
+                content if isinstance(content, bytes) else content.encode(),
+            )
+        return {"path": params["path"], "size": len(content)}
+
+    async def _watch_filesystem(self):
+        """root_dir以下の変更をwatchfilesで監視し、通知として送出する"""
+        # watchfilesのバーストでイベントごとにPathを作らないよう、
+        # 文字列スライスで相対パスを求める
+        root_len = len(self._root_str) + 1
+
+        def rel(path: str) -> str:
+            if path.startswith(self._root_str_sep):
+                return path[root_len:]
+            return str(Path(path).relative_to(self.root_dir))
+
+        async for changes in awatch(self.root_dir):
+            # ツリーが変わったら古い解決結果を捨てる
+            _resolve_cached.cache_clear()
+            if self.batch_change_notifications:
+                # 1バッチ＝1通知にまとめてフレーミングコストを償却する
+                await self.notify("filesystem/changes", {
+                    "type": "filesystem_changes",
+                    "changes": [
+                        {"change_type": int(change_type), "path": rel(path)}
+                        for change_type, path in changes
+                    ],
+                })
+            else:
+                for change_type, path in changes:
+                    await self.notify("filesystem/changed", {
+                        "change_type": int(change_type),
+                        "path": rel(path),
+                    })
+
+    async def notify(self, method: str, params: Dict[str, Any]):
+        await self._send({"jsonrpc": "2.0", "method": method, "params": params})
+
+    async def _send(self, message: Dict[str, Any]):
+        async with self._send_lock:
+            self._writer.write((json.dumps(message) + "\n").encode())
+            await self._writer.drain()
@@ -26,6 +26,9 @@ class MCPClient:
         self.session = await session.__aenter__()
         await self.session.initialize()
 
+    async def disconnect(self):
+        await self.__aexit__(None, None, None)
+
     async def get_available_tools(self) -> List[Any]:
         if not self.session:
             raise RuntimeError("Not connected to MCP server")
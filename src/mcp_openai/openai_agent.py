@@ -1,11 +1,40 @@
-import json
+import asyncio
 import re
 import os
+
+import httpx
+import orjson
 from typing import Optional
 from dotenv import load_dotenv
 
 from openai import OpenAI, AsyncOpenAI
 
+# APIキーごとに共有するAsyncOpenAIクライアント
+_shared_clients = {}
+
+
+def _get_shared_client(api_key: str) -> AsyncOpenAI:
+    """同じAPIキーのエージェント間で1つのクライアントを使い回す
+
+    エージェントごとに接続プールを作り直すと毎回TCP+TLSハンドシェイク
+    を払うことになるため、keepaliveの効いたHTTP/2クライアントを共有する。
+    """
+    client = _shared_clients.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=api_key,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=100, max_keepalive_connections=20
+                ),
+                timeout=60.0,
+            ),
+        )
+        _shared_clients[api_key] = client
+    return client
+
+
 class OpenAIAgent:
     def __init__(
         self,
@@ -24,7 +53,7 @@ class OpenAIAgent:
             )
             
         self.model_id = model_id
-        self.client = AsyncOpenAI(api_key=self.api_key)
+        self.client = _get_shared_client(self.api_key)
         self.system_prompt = system_prompt
         
         # 初期化時にsystemメッセージを設定
@@ -32,11 +61,16 @@ class OpenAIAgent:
             {"role": "system", "content": self.system_prompt}
         ]
         self.tools = None
+        self._cached_tools = None
         self.response_output_tags = []
+        self._tag_re = None
 
         self.max_tool_invocations = max_tool_invocations
         self.tool_invocation_count = 0
 
+        # 履歴の上限（超えた分は古いターンから削る）
+        self._max_history = 40
+
     def set_system_prompt(self, prompt: str):
         """Systemプロンプトを変更し、メッセージ履歴をリセットする"""
         self.system_prompt = prompt
@@ -44,11 +78,35 @@ class OpenAIAgent:
             {"role": "system", "content": self.system_prompt}
         ]
 
+    def invalidate_tools_cache(self):
+        """ツール定義を変更した際にキャッシュを破棄する"""
+        self._cached_tools = None
+
+    def set_response_output_tags(self, open_tag: str, close_tag: str):
+        """レスポンス抽出用のタグを設定し、パターンを一度だけコンパイルする"""
+        self.response_output_tags = [open_tag, close_tag]
+        self._tag_re = re.compile(
+            f"{re.escape(open_tag)}(.*?){re.escape(close_tag)}", re.S
+        )
+
     async def invoke_with_prompt(self, prompt: str):
         """ユーザーからの新たなプロンプトに応答する"""
         self.messages.append({"role": "user", "content": prompt})
+        self._trim_history()
         return await self.invoke()
 
+    def _trim_history(self):
+        """履歴が上限を超えたら、systemメッセージを残して古いターンから削る
+
+        毎ターン全履歴をAPIに送り直すため、履歴を放置すると
+        アップロードサイズとシリアライズのコストが際限なく増える。
+        """
+        while len(self.messages) > self._max_history and len(self.messages) > 1:
+            del self.messages[1]
+            # 対応するassistantメッセージを失ったtoolメッセージも一緒に削る
+            while len(self.messages) > 1 and self.messages[1].get("role") == "tool":
+                del self.messages[1]
+
     async def get_response(self):
         """OpenAI APIにクエリを送り、completionを取得する関数"""
         params = {
@@ -57,66 +115,78 @@ class OpenAIAgent:
         }
         
         # toolsが設定されている場合のみパラメータに追加
-        if self.tools:
-            tools = self.tools.get_tools()
-            if tools:  # toolsが空でない場合のみ追加
-                params["tools"] = tools
-                params["tool_choice"] = "auto"
+        # （ツールセットは通常ターン間で変わらないので、毎回リストを
+        # 組み立て直さずキャッシュする）
+        if self.tools and self._cached_tools is None:
+            self._cached_tools = self.tools.get_tools() or None
+        if self._cached_tools:  # toolsが空でない場合のみ追加
+            params["tools"] = self._cached_tools
+            params["tool_choice"] = "auto"
         
         completion = await self.client.chat.completions.create(**params)
         return completion
 
 
     async def invoke(self):
-        if self.tool_invocation_count > self.max_tool_invocations:
-            # ツール呼び出し回数の上限に達したら終了
-            return "Tool invocation limit exceeded. Stopping to prevent infinite loop."
-
-        completion = await self.get_response()
-        choice = completion.choices[0]
-        message = choice.message
-        finish_reason = choice.finish_reason
-        assistant_content = message.content
-
-        # 必要ならレスポンスタグ処理
-        if self.response_output_tags and len(self.response_output_tags) == 2:
-            pattern = f"(?s).*{re.escape(self.response_output_tags[0])}(.*?){re.escape(self.response_output_tags[1])}"
-            match = re.search(pattern, assistant_content)
-            if match:
-                assistant_content = match.group(1)
-
-        self.messages.append({
-            "role": "assistant",
-            "content": assistant_content,
-            "tool_calls": message.tool_calls if hasattr(message, 'tool_calls') else None
-        })
-
-        # ツール呼び出しがある場合
-        if finish_reason == "tool_calls":
+        # 再帰ではなくループで回すことで、深いツールチェーンでも
+        # スタックが成長しない
+        while self.tool_invocation_count <= self.max_tool_invocations:
+            completion = await self.get_response()
+            choice = completion.choices[0]
+            message = choice.message
+            finish_reason = choice.finish_reason
+            assistant_content = message.content
+
+            # 必要ならレスポンスタグ処理
+            # （tool_callsターンではcontentがNoneになる点に注意）
+            if self._tag_re and assistant_content:
+                match = self._tag_re.search(assistant_content)
+                if match:
+                    assistant_content = match.group(1)
+
+            # tool_callsがないターンにNoneフィールドを持ち込まない
+            # （以降の全リクエストで再シリアライズされるため）
+            assistant_message = {"role": "assistant", "content": assistant_content}
+            message_tool_calls = getattr(message, 'tool_calls', None)
+            if message_tool_calls:
+                assistant_message["tool_calls"] = message_tool_calls
+            self.messages.append(assistant_message)
+
+            # ツール呼び出しがない場合はここで終了
+            if finish_reason != "tool_calls":
+                return assistant_content if assistant_content else ""
+
             self.tool_invocation_count += 1
 
-            tool_calls = message.tool_calls or []
-            for call in tool_calls:
-                func_info = call.function
-                func_name = func_info.name
-                arguments_str = func_info.arguments
-                arguments = json.loads(arguments_str)
-                tool_use_id = call.id
-
-                # MCPサーバ上のツールを実行
-                tool_result = await self.tools.execute_tool(func_name, arguments)
-                # ツール結果をtoolロールメッセージとして履歴にコミット
+            tool_calls = message_tool_calls or []
+            # MCPサーバ上のツールはI/Oバウンドなので並行実行する
+            coros = [
+                self.tools.execute_tool(
+                    call.function.name, orjson.loads(call.function.arguments)
+                )
+                for call in tool_calls
+            ]
+            results = await asyncio.gather(*coros, return_exceptions=True)
+
+            # ツール結果を元の呼び出し順でtoolロールメッセージとして履歴にコミット
+            for call, tool_result in zip(tool_calls, results):
+                if isinstance(tool_result, BaseException):
+                    tool_result = {
+                        "call": call.function.name,
+                        "result": f"Error executing tool: {tool_result}"
+                    }
                 function_call_result_message = {
                     "role": "tool",
-                    "content": json.dumps(tool_result),
-                    "tool_call_id": tool_use_id
+                    "content": orjson.dumps(tool_result).decode(),
+                    "tool_call_id": call.id
                 }
                 self.messages.append(function_call_result_message)
 
-            # ツール使用結果を反映させるため再度モデルに問い合わせ
-            return await self.invoke()
+            self._trim_history()
+            # ツール使用結果を反映させるため次のループで再度モデルに問い合わせ
 
-        return assistant_content if assistant_content else ""
+        # ツール呼び出し回数の上限に達したら終了
+        return "Tool invocation limit exceeded. Stopping to prevent infinite loop."
 
 # import asyncio
 # from typing import Optional
@@ -1,6 +1,7 @@
 import asyncio
 import os
 import sys
+from aioconsole import ainput
 from mcp import StdioServerParameters
 from openai_agent import OpenAIAgent
 from openai_tools import OpenAIToolManager
@@ -30,17 +31,46 @@ questions and perform tasks. If you need to use a tool, respond with a JSON cont
         )
     ]
 
-    # 各サーバーに対してMCPClientを作成
-    clients = []
-    for server_param in servers:
-        client = MCPClient(server_param)
+    # 各サーバーに対してMCPClientを作成する。
+    # stdio_client/ClientSessionが入るanyioのcancel scopeは、入ったのと
+    # 同じタスクで抜ける必要があるため、接続から切断までのライフサイクル
+    # 全体を1クライアント=1タスクに所有させ、そのタスク同士を並行に走らせる
+    clients = [MCPClient(server_param) for server_param in servers]
+    stop_event = asyncio.Event()
+
+    async def client_lifecycle(client: MCPClient, ready: asyncio.Event):
         await client.connect()
-        clients.append(client)
+        ready.set()
+        try:
+            await stop_event.wait()
+        finally:
+            await client.disconnect()
+
+    ready_events = [asyncio.Event() for _ in clients]
+    lifecycle_tasks = [
+        asyncio.create_task(client_lifecycle(client, ready))
+        for client, ready in zip(clients, ready_events)
+    ]
 
     try:
-        # 各クライアントからツールを登録
-        for client in clients:
-            tools = await client.get_available_tools()
+        # 全クライアントの接続完了を待つ。接続に失敗したタスクは
+        # readyを立てる前に終了するので、そちらの例外を伝播させる
+        ready_all = asyncio.ensure_future(
+            asyncio.gather(*(ready.wait() for ready in ready_events))
+        )
+        done, _ = await asyncio.wait(
+            {ready_all, *lifecycle_tasks}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if ready_all not in done:
+            ready_all.cancel()
+            for task in done:
+                task.result()
+
+        # 各クライアントからツール一覧を並行取得して登録
+        tool_lists = await asyncio.gather(
+            *(client.get_available_tools() for client in clients)
+        )
+        for client, tools in zip(clients, tool_lists):
             for tool in tools:
                 agent.tools.register_tool(
                     name=tool.name,
@@ -52,7 +82,8 @@ questions and perform tasks. If you need to use a tool, respond with a JSON cont
         # メインのインタラクションループ
         while True:
             try:
-                user_prompt = input("\nEnter your prompt (or 'quit' to exit): ").strip()
+                # 入力待ちの間もイベントループを止めない
+                user_prompt = (await ainput("\nEnter your prompt (or 'quit' to exit): ")).strip()
                 if user_prompt.lower() in ['quit', 'exit', 'q']:
                     break
 
@@ -66,9 +97,16 @@ questions and perform tasks. If you need to use a tool, respond with a JSON cont
                 print(f"\nError occurred: {e}")
 
     finally:
-        # クリーンアップ: すべてのクライアントを切断
-        for client in clients:
-            await client.disconnect()
+        # クリーンアップ: 各ライフサイクルタスクに自分のクライアントを
+        # 切断させてから、全タスクの終了を待つ
+        stop_event.set()
+        await asyncio.gather(*lifecycle_tasks, return_exceptions=True)
 
 if __name__ == "__main__":
+    # 利用可能ならlibuvベースのイベントループに差し替える
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())